@@ -3,14 +3,28 @@ Flask web app for control and dashboard.
 Provides start/stop motion control and displays latest images from ESP32-CAM.
 """
 
-from flask import Flask, jsonify, request, send_from_directory # Added send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory, make_response # Added send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.security import safe_join
+from werkzeug.exceptions import RequestEntityTooLarge
 import threading
+import queue
 import time
 import os
+import json
+import heapq
+from collections import deque
 import logging
+from buffer_pool import BufferPool
 # import glob # Not strictly needed if managing images via list, but can keep for other uses
 
+# orjson is optional; without it responses use Flask's default stdlib json provider
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Hardware imports - ensure these modules exist and work correctly
 # If any of these imports fail, the corresponding hardware functionality
 # will be disabled, but the web server will still run.
@@ -33,14 +47,42 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 # --- Flask App Initialization ---
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson, which is much cheaper than stdlib json on the Pi."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app) # jsonify() now serializes through orjson
 CORS(app) # Enable CORS for web dashboard. This is crucial for cross-origin requests from your browser.
+# Largest accepted upload, matching client_max_body_size in nginx/underwater-robot.conf. Setting it
+# also makes werkzeug wrap the input in a LimitedStream even when the server (gunicorn) marks it
+# as terminated, so request.stream always supports readinto()
+MAX_UPLOAD_SIZE = 8 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 
 # --- Global State Variables ---
-motion_running = False # Tracks if autonomous motion is active
+motion_stop = threading.Event() # Cleared while autonomous motion is active; set to stop it
+motion_stop.set()
 motion_thread = None   # Thread for autonomous logic
-latest_images = []     # List to store URLs/paths of the latest images for the dashboard
+CONTROL_PERIOD = 0.05  # Seconds between autonomous control steps (20 Hz)
 MAX_IMAGES_TO_DISPLAY = 5 # Number of latest images to keep in memory for the dashboard
+latest_images = deque(maxlen=MAX_IMAGES_TO_DISPLAY) # URLs of the latest images for the dashboard, newest first
+latest_images_lock = threading.Lock() # Guards latest_images between upload and dashboard requests
+UPLOAD_CHUNK_SIZE = 64 * 1024 # Bytes copied per read when streaming an upload to disk
+UPLOAD_BUFFER_COUNT = 8 # Pre-allocated upload buffers, roughly one per concurrent upload
+upload_buffers = BufferPool(UPLOAD_BUFFER_COUNT, UPLOAD_CHUNK_SIZE)
+frame_subscribers = [] # One queue per /stream viewer, fed with paths of newly uploaded frames
+frame_subscribers_lock = threading.Lock()
+STREAM_QUEUE_SIZE = 4  # Frames buffered per viewer before new frames are dropped for it
+# Each /stream viewer holds a server thread for as long as it is connected. Keep this well below
+# the gunicorn --threads count (8) so /stop, /status and uploads always have threads left.
+MAX_STREAM_VIEWERS = 4
+STREAM_KEEPALIVE = 5   # Seconds without a new frame before the last one is re-sent to the viewer
 
 # --- Directory for Image Storage ---
 # This path points to the 'images' directory in the root of your project
@@ -48,6 +90,15 @@ MAX_IMAGES_TO_DISPLAY = 5 # Number of latest images to keep in memory for the da
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, 'images')
 
+# --- Hardware Configuration ---
+# Pin assignments for the sensors live in config.json next to this file (override with ROBOT_CONFIG)
+CONFIG_PATH = os.environ.get('ROBOT_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json'))
+
+# When running behind nginx, set IMAGE_ACCEL_REDIRECT_PREFIX (e.g. /protected/) to an internal
+# location aliased to UPLOAD_FOLDER. /images/<filename> then hands the file to nginx via
+# X-Accel-Redirect, so it is sent with sendfile(2) instead of being copied through Python.
+IMAGE_ACCEL_REDIRECT_PREFIX = os.environ.get('IMAGE_ACCEL_REDIRECT_PREFIX')
+
 # Ensure the upload directory exists
 try:
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -55,6 +106,23 @@ try:
 except OSError as e:
     logger.error(f"Failed to create image upload directory {UPLOAD_FOLDER}: {e}")
 
+def load_latest_images():
+    """
+    Returns URLs of the newest images already in UPLOAD_FOLDER, newest first.
+    Uses a single os.scandir pass and keeps only the newest MAX_IMAGES_TO_DISPLAY entries,
+    so the cost stays low even with thousands of frames on the SD card.
+    """
+    with os.scandir(UPLOAD_FOLDER) as it:
+        entries = [(entry.stat().st_mtime, entry.name) for entry in it
+                   if entry.name.endswith('.jpg') and entry.is_file()]
+    return [f"/images/{name}" for _, name in heapq.nlargest(MAX_IMAGES_TO_DISPLAY, entries)]
+
+# Seed the dashboard list with images saved before a restart
+try:
+    latest_images.extend(load_latest_images())
+except OSError as e:
+    logger.error(f"Failed to scan image upload directory {UPLOAD_FOLDER}: {e}")
+
 # --- Hardware Initialization (Conditional) ---
 motor_control = None
 mpu6050 = None
@@ -65,12 +133,16 @@ autonomous_logic = None
 
 if HARDWARE_INITIALIZED:
     try:
+        with open(CONFIG_PATH) as f:
+            config = json.load(f)
+
         motor_control = MotorControl()
         mpu6050 = MPU6050()
-        # Ensure pin numbers here match your physical connections for UltrasonicSensor
-        front_sensor = UltrasonicSensor(trigger_pin=5, echo_pin=25)
-        back_sensor = UltrasonicSensor(trigger_pin=7, echo_pin=8)
-        bottom_sensor = UltrasonicSensor(trigger_pin=20, echo_pin=21)
+        # Ensure pin numbers in config.json match your physical connections for UltrasonicSensor
+        sensor_pins = config['sensors']
+        front_sensor = UltrasonicSensor(**sensor_pins['front'])
+        back_sensor = UltrasonicSensor(**sensor_pins['back'])
+        bottom_sensor = UltrasonicSensor(**sensor_pins['bottom'])
         
         autonomous_logic = AutonomousLogic(motor_control, mpu6050, front_sensor, back_sensor, bottom_sensor)
         logger.info("Hardware components initialized successfully.")
@@ -82,25 +154,67 @@ if HARDWARE_INITIALIZED:
 # --- Autonomous Logic Thread Function ---
 def autonomous_run():
     """Runs autonomous logic in a separate thread."""
-    global motion_running
     logger.info("Autonomous motion thread started.")
     try:
-        while motion_running:
-            if autonomous_logic:
-                autonomous_logic.run()
-            else:
-                logger.warning("Autonomous logic is not initialized. Skipping run cycle.")
-                time.sleep(1) # Still sleep to prevent busy-looping if not initialized
-            time.sleep(1) # Control loop delay
+        if not autonomous_logic:
+            logger.warning("Autonomous logic is not initialized. Nothing to run.")
+            return
+        autonomous_logic.reset() # Every start begins a fresh mission
+        next_tick = time.monotonic()
+        while not motion_stop.is_set():
+            autonomous_logic.run()
+            # Fixed-rate control loop; wakes immediately when /stop sets the event
+            next_tick = max(next_tick + CONTROL_PERIOD, time.monotonic())
+            if motion_stop.wait(next_tick - time.monotonic()):
+                break
     except Exception as e:
         logger.error(f"Critical error in autonomous run thread: {e}")
-        motion_running = False # Stop motion on error
+        motion_stop.set() # Stop motion on error
         if motor_control:
             motor_control.stop() # Ensure motors stop on error
     finally:
         logger.info("Autonomous motion thread stopped.")
 
 
+def save_upload_stream(stream, f):
+    """Copies a raw upload stream to the open file f through a pooled buffer. Returns bytes written."""
+    if not hasattr(stream, 'readinto'):
+        # Server input objects such as gunicorn's Body only provide read()
+        written = 0
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+        return written
+
+    buf = upload_buffers.acquire()
+    view = memoryview(buf)
+    written = 0
+    try:
+        while True:
+            n = stream.readinto(buf)
+            if not n:
+                break
+            f.write(view[:n])
+            written += n
+    finally:
+        view.release()
+        upload_buffers.release(buf)
+    return written
+
+def publish_frame(filepath):
+    """Hands a newly saved frame to every /stream viewer, skipping viewers that have fallen behind."""
+    with frame_subscribers_lock:
+        subscribers = list(frame_subscribers)
+    for q in subscribers:
+        try:
+            q.put_nowait(filepath)
+        except queue.Full:
+            pass
+
+
 # --- API Endpoints ---
 
 @app.route('/')
@@ -113,7 +227,7 @@ def get_status():
     """Returns the current motion status of the robot and hardware initialization status."""
     try:
         return jsonify({
-            'motion_running': motion_running,
+            'motion_running': not motion_stop.is_set(),
             'hardware_initialized': HARDWARE_INITIALIZED,
             'success': True
         })
@@ -124,13 +238,13 @@ def get_status():
 @app.route('/start', methods=['POST'])
 def start_motion():
     """Starts the autonomous motion control."""
-    global motion_running, motion_thread
+    global motion_thread
     try:
         if not HARDWARE_INITIALIZED:
             return jsonify({'status': 'error', 'message': 'Hardware not initialized. Cannot start motion.', 'success': False}), 500
             
-        if not motion_running:
-            motion_running = True
+        if motion_stop.is_set():
+            motion_stop.clear()
             motion_thread = threading.Thread(target=autonomous_run)
             motion_thread.daemon = True # Allow main program to exit even if thread is running
             motion_thread.start()
@@ -145,10 +259,10 @@ def start_motion():
 @app.route('/stop', methods=['POST'])
 def stop_motion():
     """Stops the autonomous motion control."""
-    global motion_running, motion_thread
+    global motion_thread
     try:
-        if motion_running:
-            motion_running = False
+        if not motion_stop.is_set():
+            motion_stop.set() # Wakes the motion thread out of any wait so it exits promptly
             # Wait for the thread to finish cleanly (up to 5 seconds)
             if motion_thread and motion_thread.is_alive():
                 motion_thread.join(timeout=5)
@@ -172,51 +286,71 @@ def upload_image():
     Updates the list of latest images for the web dashboard.
     """
     global latest_images
-    image_data = None
+    image_file = None
     
-    # Check if content type is 'image/jpeg' for raw binary upload (preferred for ESP32-CAM)
-    if request.content_type == 'image/jpeg':
-        image_data = request.get_data()
-        if not image_data:
-            logger.warning("No raw image data received in POST request.")
-            return jsonify({"error": "No image data received"}), 400
+    # A raw binary upload with content type 'image/jpeg' (preferred for ESP32-CAM)
+    # is streamed straight from request.stream below.
     # Fallback: Check for multipart/form-data with a file field named 'image'
-    elif 'image' in request.files:
+    if request.content_type != 'image/jpeg':
+        if 'image' not in request.files:
+            logger.warning(f"Unsupported Content-Type for image upload: {request.content_type}")
+            return jsonify({"error": "No image part or unsupported content type"}), 400
         image_file = request.files['image']
         if image_file.filename == '':
             logger.warning("Received multipart form data but no file selected.")
             return jsonify({"error": "No selected file"}), 400
-        image_data = image_file.read()
-    else:
-        logger.warning(f"Unsupported Content-Type for image upload: {request.content_type}")
-        return jsonify({"error": "No image part or unsupported content type"}), 400
 
-    # Generate a unique filename using timestamp
+    # Generate a unique filename using a nanosecond timestamp, so several frames per second
+    # (and several cameras) never share a name
     # Ensure this doesn't conflict with existing filenames if you also scan from ESP32 SD card
-    filename = f"esp32_cam_{int(time.time())}.jpg"
+    filename = f"esp32_cam_{time.time_ns()}.jpg"
     filepath = os.path.join(UPLOAD_FOLDER, filename)
+    # The frame is written to a temporary file and only renamed into place once complete, so
+    # empty or interrupted uploads never appear under an image name (load_latest_images only
+    # picks up .jpg files)
+    temp_path = filepath + '.part'
+    temp_created = False
 
     try:
-        with open(filepath, 'wb') as f:
-            f.write(image_data)
+        # Stream the frame to disk in fixed-size chunks instead of materializing
+        # the whole JPEG as a bytes object first. 'x' refuses to reuse an existing file.
+        with open(temp_path, 'xb') as f:
+            temp_created = True
+            if image_file is not None:
+                image_file.save(f, buffer_size=UPLOAD_CHUNK_SIZE)
+            else:
+                save_upload_stream(request.stream, f)
+
+        size = os.path.getsize(temp_path)
+        if size == 0:
+            os.remove(temp_path)
+            logger.warning("No raw image data received in POST request.")
+            return jsonify({"error": "No image data received"}), 400
+        os.replace(temp_path, filepath)
         
         # Construct URL relative to the Flask server's image serving endpoint
-        # e.g., /images/esp32_cam_1678886400.jpg
+        # e.g., /images/esp32_cam_1678886400123456789.jpg
         image_url = f"/images/{filename}" 
         
-        # Add the new image URL to the front of the list
-        latest_images.insert(0, image_url) 
-        
-        # Maintain the maximum number of images to display
-        if len(latest_images) > MAX_IMAGES_TO_DISPLAY:
-            # Optionally, you could delete the actual oldest file from disk here
-            # os.remove(os.path.join(UPLOAD_FOLDER, os.path.basename(latest_images.pop())))
-            latest_images.pop() # Just remove from the list for now
+        with latest_images_lock:
+            # Add the new image URL to the front; the deque drops the oldest one once it
+            # holds MAX_IMAGES_TO_DISPLAY (the file itself stays on disk)
+            latest_images.appendleft(image_url)
+
+        publish_frame(filepath)
 
         logger.info(f"Image uploaded and saved to: {filepath}")
-        return jsonify({"message": "Image uploaded successfully", "filename": filename, "url": image_url}), 200
+        return jsonify({"message": "Image uploaded successfully", "filename": filename, "url": image_url, "size": size}), 200
     except Exception as e:
         logger.error(f"Error saving uploaded image to disk: {e}")
+        # Don't leave a partial frame behind (e.g. after a client disconnect)
+        if temp_created:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        if isinstance(e, RequestEntityTooLarge):
+            return jsonify({"error": f"Image larger than {MAX_UPLOAD_SIZE} bytes"}), 413
         return jsonify({"error": f"Failed to save image: {e}"}), 500
 
 @app.route('/images/<filename>', methods=['GET'])
@@ -225,6 +359,14 @@ def serve_image(filename):
     Serves static image files from the UPLOAD_FOLDER to the web dashboard.
     """
     try:
+        if IMAGE_ACCEL_REDIRECT_PREFIX:
+            filepath = safe_join(UPLOAD_FOLDER, filename)
+            if filepath is None or not os.path.isfile(filepath):
+                raise FileNotFoundError(filename)
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = f"{IMAGE_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{filename}"
+            response.headers['Content-Type'] = 'image/jpeg'
+            return response
         return send_from_directory(UPLOAD_FOLDER, filename)
     except FileNotFoundError:
         logger.error(f"Image file not found: {filename}")
@@ -240,10 +382,13 @@ def get_latest_images_for_dashboard():
     The web dashboard will call this.
     """
     try:
-        # Return the list of images URLs that Flask is managing from uploads
+        # Return a snapshot of the image URLs that Flask is managing from uploads,
+        # so a concurrent upload can't change the list while it is being serialized
+        with latest_images_lock:
+            snapshot = list(latest_images)
         return jsonify({
-            'images': latest_images,
-            'count': len(latest_images),
+            'images': snapshot,
+            'count': len(snapshot),
             'success': True
         })
     except Exception as e:
@@ -251,6 +396,52 @@ def get_latest_images_for_dashboard():
         return jsonify({'images': [], 'count': 0, 'success': False, 'message': str(e)})
 
 
+@app.route('/stream', methods=['GET'])
+def stream():
+    """
+    Streams frames as MJPEG (multipart/x-mixed-replace) as soon as they are uploaded.
+    The dashboard gets a live view over one connection instead of polling /images.
+    """
+    q = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    with frame_subscribers_lock:
+        if len(frame_subscribers) >= MAX_STREAM_VIEWERS:
+            logger.warning(f"Refusing /stream viewer: {MAX_STREAM_VIEWERS} already connected.")
+            return jsonify({'error': 'Too many stream viewers', 'success': False}), 503
+        frame_subscribers.append(q)
+
+    def unsubscribe():
+        with frame_subscribers_lock:
+            frame_subscribers.remove(q)
+
+    def generate():
+        part = None
+        while True:
+            try:
+                filepath = q.get(timeout=STREAM_KEEPALIVE)
+            except queue.Empty:
+                # Nothing new: write something anyway, so a viewer that has gone away is
+                # noticed (the write fails) and its thread is released even while the camera is idle
+                yield part if part is not None else b'\r\n'
+                continue
+            try:
+                # Just written by upload_image, so this is served from the page cache
+                with open(filepath, 'rb') as f:
+                    frame = f.read()
+            except OSError as e:
+                logger.warning(f"Skipping stream frame {filepath}: {e}")
+                continue
+            part = (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                    + str(len(frame)).encode() + b'\r\n\r\n' + frame + b'\r\n')
+            yield part
+
+    response = Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # Runs when the server closes the response, including after a failed write to a dead viewer
+    response.call_on_close(unsubscribe)
+    # Tell nginx not to buffer the parts, so each frame reaches the browser as soon as it is sent
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # --- Error Handlers ---
 @app.errorhandler(404)
 def not_found(error):
@@ -263,7 +454,14 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error', 'success': False}), 500
 
 # --- Main Run Block ---
+# Development server only. In production the app runs under gunicorn (see setup.sh):
+#   gunicorn -k gthread -w 1 --threads 8 -b 0.0.0.0:5000 app:app
+# Keep a single worker process: the motors and sensors can only be owned by one process.
 if __name__ == '__main__':
     logger.info("Starting Flask application...")
-    # This makes the Flask app accessible from any device on the network on port 5000
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # This makes the Flask app accessible from any device on the network on port 5000.
+    # threaded=True serves each request on its own thread, so a slow SD-card write in
+    # /upload_image never holds up /status or /images polls from the dashboard.
+    # The reloader is disabled: it re-imports this module in a child process, which would
+    # initialize MotorControl and the sensors twice and fight over the GPIO pins.
+    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False, threaded=True)
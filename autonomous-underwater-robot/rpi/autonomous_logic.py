@@ -1,9 +1,59 @@
 """
 Autonomous logic module for underwater robot.
 Implements rectangle lap movement, obstacle avoidance, stabilization, and depth control.
+The mission runs as a state machine: each call to AutonomousLogic.run() performs one
+non-blocking control step, so the caller sets the control rate.
 """
 
+import logging
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from sensors import read_all, combine_readings, PITCH, ROLL
+
+logger = logging.getLogger(__name__)
+
+# Diagnostic only: logged at startup so it's clear whether the interpreter is free-threaded (3.13t).
+# Sampling runs the same way either way.
+try:
+    from sys import _is_gil_enabled
+    FREETHREADING = not _is_gil_enabled()
+except ImportError:
+    FREETHREADING = False
+
+# Commands returned by decide()
+STOP = 0
+FORWARD = 1
+
+# Mission phases, in order; 'done' rests briefly before the next mission starts
+SUBMERGE = 'submerge'
+LAP = 'lap'
+SURFACE = 'surface'
+DONE = 'done'
+
+# Sonars read each control tick, by their key in the sample from AutonomousLogic._sample()
+SONARS = ('front', 'back', 'bottom')
+ECHO_HISTORY = 3 # Recent readings per sonar combined to reject spurious echoes
+
+def _range(distance):
+    """
+    Sonar reading in cm; a missing echo (None) means nothing is within range.
+    AutonomousLogic only trusts this for a few ticks in a row (see max_missed_echoes).
+    """
+    return float('inf') if distance is None else distance
+
+def decide(pitch, roll, front, back, depth, tilt_threshold, depth_threshold):
+    """
+    Control law for one lap tick. Takes plain floats (degrees and cm) and returns
+    FORWARD when it is safe to move, otherwise STOP.
+    """
+    if front < depth_threshold or back < depth_threshold:
+        return STOP
+    if abs(pitch) > tilt_threshold or abs(roll) > tilt_threshold:
+        return STOP
+    if depth < depth_threshold:
+        return STOP
+    return FORWARD
 
 class AutonomousLogic:
     def __init__(self, motor_control, mpu6050, front_sensor, back_sensor, bottom_sensor):
@@ -16,51 +66,112 @@ class AutonomousLogic:
         self.depth_threshold = 10  # cm
         self.lap_time = 30  # seconds per lap
         self.laps = 2
+        self.submerge_time = 5  # seconds
+        self.surface_time = 5  # seconds
+        self.rest_time = 1  # seconds between missions
+        self.obstacle_hold_time = 1  # seconds to stay stopped after an unsafe reading
+        # Consecutive ticks a sonar may go without an echo before it is treated as failed
+        # (unplugged or blocked) and the robot stops, instead of reading "clear" forever
+        self.max_missed_echoes = 5
+        self._missed_echoes = dict.fromkeys(SONARS, 0)
+        # Last few readings per sonar, newest first; each tick's decision uses their combination
+        # (sensors.combine_readings) rather than a single ping, at no extra ping cost
+        self._echo_history = {name: deque(maxlen=ECHO_HISTORY) for name in SONARS}
+        # Runs the MPU6050 read while the control thread waits for the sonar echoes
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sensor')
+        logger.info(f"Sensor sampling on {'a free-threaded' if FREETHREADING else 'a GIL'} interpreter.")
+        self.reset()
+
+    def _sample(self):
+        """
+        Reads all sensors once, concurrently, and returns the readings for this control tick.
+        Tick latency is the slowest sensor read rather than the sum of all of them.
+        """
+        orientation = self._pool.submit(self.mpu6050.get_orientation)
+        front, back, bottom = read_all((self.front_sensor, self.back_sensor, self.bottom_sensor))
+        return {'front': front, 'back': back, 'bottom': bottom, 'orientation': orientation.result()}
+
+    def _sonars_ok(self, s):
+        """
+        Updates the per-sonar count of consecutive missed echoes from the sample s.
+        Returns False if any sonar has missed max_missed_echoes ticks in a row.
+        """
+        ok = True
+        for name in SONARS:
+            if s[name] is not None:
+                self._missed_echoes[name] = 0
+                continue
+            missed = self._missed_echoes[name] = self._missed_echoes[name] + 1
+            if missed >= self.max_missed_echoes:
+                if missed == self.max_missed_echoes:
+                    logger.warning(f"No echo from the {name} sonar for {missed} ticks; stopping until it reads again.")
+                ok = False
+        return ok
 
-    def check_tilt(self):
-        orientation = self.mpu6050.get_orientation()
-        pitch = orientation['pitch']
-        roll = orientation['roll']
-        if abs(pitch) > self.tilt_threshold or abs(roll) > self.tilt_threshold:
-            return True
-        return False
-
-    def check_obstacles(self):
-        front_dist = self.front_sensor.get_distance()
-        back_dist = self.back_sensor.get_distance()
-        if front_dist < self.depth_threshold or back_dist < self.depth_threshold:
-            return True
-        return False
-
-    def check_depth(self):
-        depth = self.bottom_sensor.get_distance()
-        if depth < self.depth_threshold:
-            return True
-        return False
-
-    def run_lap(self):
+    def _safe_to_move(self, s):
+        """True if the sensor sample s (from _sample) allows driving forward"""
+        sonars_ok = self._sonars_ok(s)
+        distances = {}
+        for name in SONARS:
+            history = self._echo_history[name]
+            history.appendleft(s[name])
+            distances[name] = _range(combine_readings(history))
+        if not sonars_ok:
+            return False
+        orientation = s['orientation']
+        return decide(orientation[PITCH], orientation[ROLL],
+                      distances['front'], distances['back'], distances['bottom'],
+                      self.tilt_threshold, self.depth_threshold) == FORWARD
+
+    def reset(self):
+        """Restarts the mission from the beginning on the next run() call"""
+        self._phase = None
+        self._phase_start_t = 0.0
+        self._lap = 0
+        self._hold_until = 0.0
+        for history in self._echo_history.values():
+            history.clear()
+
+    def _enter(self, phase, now):
+        self._phase = phase
+        self._phase_start_t = now
+
+    def _lap_step(self, now):
         # Simple rectangle lap: forward, right turn, forward, right turn, etc.
-        # For simplicity, just move forward for lap_time seconds twice
-        start_time = time.time()
-        while time.time() - start_time < self.lap_time:
-            if self.check_obstacles() or self.check_tilt() or not self.check_depth():
-                self.motor_control.stop()
-                time.sleep(1)
+        # For simplicity, just move forward for lap_time seconds per lap
+        if now - self._phase_start_t >= self.lap_time:
+            self.motor_control.stop()
+            self._lap += 1
+            if self._lap < self.laps:
+                self._enter(LAP, now)
             else:
+                # Auto float up at the end of the mission
+                self.motor_control.up(70)
+                self._enter(SURFACE, now)
+        elif now >= self._hold_until:
+            if self._safe_to_move(self._sample()):
                 self.motor_control.forward(70)
-            time.sleep(0.1)
-        self.motor_control.stop()
+            else:
+                self.motor_control.stop()
+                self._hold_until = now + self.obstacle_hold_time
 
     def run(self):
-        # Auto submerge on start
-        self.motor_control.down(70)
-        time.sleep(5)  # submerge for 5 seconds
-        self.motor_control.stop()
-
-        for _ in range(self.laps):
-            self.run_lap()
-
-        # Auto float up on stop
-        self.motor_control.up(70)
-        time.sleep(5)
-        self.motor_control.stop()
+        """Performs one control step of the mission. Never sleeps; call it at the control rate."""
+        now = time.monotonic()
+        if self._phase is None:
+            # Auto submerge on start
+            self.motor_control.down(70)
+            self._enter(SUBMERGE, now)
+        elif self._phase == SUBMERGE:
+            if now - self._phase_start_t >= self.submerge_time:
+                self.motor_control.stop()
+                self._enter(LAP, now)
+        elif self._phase == LAP:
+            self._lap_step(now)
+        elif self._phase == SURFACE:
+            if now - self._phase_start_t >= self.surface_time:
+                self.motor_control.stop()
+                self._enter(DONE, now)
+        elif self._phase == DONE:
+            if now - self._phase_start_t >= self.rest_time:
+                self.reset()
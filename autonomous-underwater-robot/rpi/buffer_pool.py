@@ -0,0 +1,28 @@
+"""
+Buffer pool module for reusable upload buffers.
+Hands out pre-allocated bytearray slabs so request handlers don't allocate a fresh buffer per upload.
+"""
+
+import queue
+
+class BufferPool:
+    def __init__(self, count, size):
+        self.size = size
+        # LIFO so the most recently returned (cache-warm) slab is handed out first
+        self._buffers = queue.LifoQueue(maxsize=count)
+        for _ in range(count):
+            self._buffers.put_nowait(bytearray(size))
+
+    def acquire(self):
+        """Rent a buffer from the pool, allocating a new one if the pool is exhausted"""
+        try:
+            return self._buffers.get_nowait()
+        except queue.Empty:
+            return bytearray(self.size)
+
+    def release(self, buf):
+        """Return a buffer to the pool; extra buffers allocated under load are dropped"""
+        try:
+            self._buffers.put_nowait(buf)
+        except queue.Full:
+            pass
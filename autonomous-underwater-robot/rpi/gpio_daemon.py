@@ -0,0 +1,21 @@
+"""
+Shared connection to the pigpio daemon.
+Motor and sensor drivers all talk to pigpiod over this one connection instead of opening one each.
+"""
+
+import threading
+import pigpio
+
+_pi = None
+_pi_lock = threading.Lock()
+
+def get_pi():
+    """Returns the process-wide pigpio connection, opening it on first use"""
+    global _pi
+    with _pi_lock:
+        if _pi is None or not _pi.connected:
+            pi = pigpio.pi()
+            if not pi.connected:
+                raise RuntimeError("Could not connect to the pigpio daemon. Is pigpiod running?")
+            _pi = pi
+        return _pi
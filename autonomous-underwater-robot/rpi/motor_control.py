@@ -2,126 +2,152 @@
 Motor control module for 4 propellers using L298N motor drivers.
 Controls 4 motors independently: left/right for movement and front/back for vertical control.
 Each L298N driver controls 2 motors using all 4 inputs (IN1-IN4) and both enables (ENA, ENB).
+GPIO access goes through the pigpio daemon (pigpiod must be running).
+Speed is set with the Pi's hardware PWM: left/right enables share PWM channel 0 (GPIO 18, 12)
+and front/back enables share PWM channel 1 (GPIO 13, 19), so both motors of an axis always
+run at the same duty cycle.
 """
 
-import RPi.GPIO as GPIO
-import time
+import threading
+import pigpio
+from gpio_daemon import get_pi
+
+PWM_FREQUENCY = 1000 # Hz
+
+def _mask(*pins):
+    """Bit mask for the given BCM pins, for use with pigpio's bank 1 (GPIO 0-31) writes"""
+    mask = 0
+    for pin in pins:
+        mask |= 1 << pin
+    return mask
+
+def _pair_masks(motor_a, a_forward, motor_b, b_forward):
+    """
+    Returns (high_mask, low_mask) driving two motors in the given directions.
+    Each motor is an (in1, in2) pin pair; forward sets in1 high and in2 low.
+    """
+    a_high, a_low = motor_a if a_forward else motor_a[::-1]
+    b_high, b_low = motor_b if b_forward else motor_b[::-1]
+    return _mask(a_high, b_high), _mask(a_low, b_low)
 
 class MotorControl:
+    _instances = 0 # Live instances in this process; the GPIO pins can only have one owner
+
     def __init__(self):
-        GPIO.setmode(GPIO.BCM)
-        
+        if MotorControl._instances:
+            raise RuntimeError("MotorControl is already initialized in this process. Call cleanup() on it first.")
+        self.pi = get_pi()
+        # Serializes motor commands from the autonomous thread and the web request threads
+        self._lock = threading.Lock()
+
         # L298N #1 - Forward/Backward Motors
         # Motor A (Left)
         self.LEFT_IN1 = 17
-        self.LEFT_IN2 = 18
-        self.LEFT_ENA = 27
+        self.LEFT_IN2 = 27
+        self.LEFT_ENA = 18   # PWM0
         # Motor B (Right)
         self.RIGHT_IN3 = 16
-        self.RIGHT_IN4 = 19
-        self.RIGHT_ENB = 26
-        
+        self.RIGHT_IN4 = 26
+        self.RIGHT_ENB = 12  # PWM0
+
         # L298N #2 - Up/Down Motors
         # Motor A (Front)
         self.FRONT_IN1 = 22
         self.FRONT_IN2 = 23
-        self.FRONT_ENA = 24
+        self.FRONT_ENA = 13  # PWM1
         # Motor B (Back)
-        self.BACK_IN3 = 12
-        self.BACK_IN4 = 13
-        self.BACK_ENB = 6
+        self.BACK_IN3 = 24
+        self.BACK_IN4 = 6
+        self.BACK_ENB = 19   # PWM1
 
-        # Setup all GPIO pins
+        # Setup direction GPIO pins
         pins = [
-            self.LEFT_IN1, self.LEFT_IN2, self.LEFT_ENA,
-            self.RIGHT_IN3, self.RIGHT_IN4, self.RIGHT_ENB,
-            self.FRONT_IN1, self.FRONT_IN2, self.FRONT_ENA,
-            self.BACK_IN3, self.BACK_IN4, self.BACK_ENB
+            self.LEFT_IN1, self.LEFT_IN2,
+            self.RIGHT_IN3, self.RIGHT_IN4,
+            self.FRONT_IN1, self.FRONT_IN2,
+            self.BACK_IN3, self.BACK_IN4
         ]
-        
-        for pin in pins:
-            GPIO.setup(pin, GPIO.OUT)
-
-        # Setup PWM for speed control (1kHz frequency)
-        self.left_pwm = GPIO.PWM(self.LEFT_ENA, 1000)
-        self.right_pwm = GPIO.PWM(self.RIGHT_ENB, 1000)
-        self.front_pwm = GPIO.PWM(self.FRONT_ENA, 1000)
-        self.back_pwm = GPIO.PWM(self.BACK_ENB, 1000)
 
-        # Start all PWM with 0% duty cycle
-        self.left_pwm.start(0)
-        self.right_pwm.start(0)
-        self.front_pwm.start(0)
-        self.back_pwm.start(0)
+        for pin in pins:
+            self.pi.set_mode(pin, pigpio.OUTPUT)
+
+        # Switch the enable pins to hardware PWM for speed control, starting at 0% duty cycle
+        for pin in (self.LEFT_ENA, self.RIGHT_ENB, self.FRONT_ENA, self.BACK_ENB):
+            self.pi.hardware_PWM(pin, PWM_FREQUENCY, 0)
+
+        # Precompute direction pin masks so each movement is one bank clear + one bank set,
+        # and all direction pins of a motor pair change together
+        left = (self.LEFT_IN1, self.LEFT_IN2)
+        right = (self.RIGHT_IN3, self.RIGHT_IN4)
+        front = (self.FRONT_IN1, self.FRONT_IN2)
+        back = (self.BACK_IN3, self.BACK_IN4)
+        self._forward_masks = _pair_masks(left, True, right, True)
+        self._backward_masks = _pair_masks(left, False, right, False)
+        self._turn_left_masks = _pair_masks(left, False, right, True)
+        self._turn_right_masks = _pair_masks(left, True, right, False)
+        self._up_masks = _pair_masks(front, True, back, True)
+        self._down_masks = _pair_masks(front, False, back, False)
+        self._pitch_up_masks = _pair_masks(front, False, back, True)
+        self._pitch_down_masks = _pair_masks(front, True, back, False)
+        self._all_dir_mask = _mask(*left, *right, *front, *back)
+        MotorControl._instances += 1
 
     def forward(self, speed: int):
         """Move forward at given speed (0-100) - both left and right motors"""
-        self._set_motor(self.LEFT_IN1, self.LEFT_IN2, self.left_pwm, True, speed)
-        self._set_motor(self.RIGHT_IN3, self.RIGHT_IN4, self.right_pwm, True, speed)
+        self._drive(self._forward_masks, self.LEFT_ENA, speed)
 
     def backward(self, speed: int):
         """Move backward at given speed (0-100) - both left and right motors"""
-        self._set_motor(self.LEFT_IN1, self.LEFT_IN2, self.left_pwm, False, speed)
-        self._set_motor(self.RIGHT_IN3, self.RIGHT_IN4, self.right_pwm, False, speed)
+        self._drive(self._backward_masks, self.LEFT_ENA, speed)
 
     def turn_left(self, speed: int):
         """Turn left - right motor forward, left motor backward"""
-        self._set_motor(self.LEFT_IN1, self.LEFT_IN2, self.left_pwm, False, speed)
-        self._set_motor(self.RIGHT_IN3, self.RIGHT_IN4, self.right_pwm, True, speed)
+        self._drive(self._turn_left_masks, self.LEFT_ENA, speed)
 
     def turn_right(self, speed: int):
         """Turn right - left motor forward, right motor backward"""
-        self._set_motor(self.LEFT_IN1, self.LEFT_IN2, self.left_pwm, True, speed)
-        self._set_motor(self.RIGHT_IN3, self.RIGHT_IN4, self.right_pwm, False, speed)
+        self._drive(self._turn_right_masks, self.LEFT_ENA, speed)
 
     def up(self, speed: int):
         """Move up at given speed (0-100) - both front and back motors"""
-        self._set_motor(self.FRONT_IN1, self.FRONT_IN2, self.front_pwm, True, speed)
-        self._set_motor(self.BACK_IN3, self.BACK_IN4, self.back_pwm, True, speed)
+        self._drive(self._up_masks, self.FRONT_ENA, speed)
 
     def down(self, speed: int):
         """Move down at given speed (0-100) - both front and back motors"""
-        self._set_motor(self.FRONT_IN1, self.FRONT_IN2, self.front_pwm, False, speed)
-        self._set_motor(self.BACK_IN3, self.BACK_IN4, self.back_pwm, False, speed)
+        self._drive(self._down_masks, self.FRONT_ENA, speed)
 
     def pitch_up(self, speed: int):
         """Pitch up - front motor down, back motor up"""
-        self._set_motor(self.FRONT_IN1, self.FRONT_IN2, self.front_pwm, False, speed)
-        self._set_motor(self.BACK_IN3, self.BACK_IN4, self.back_pwm, True, speed)
+        self._drive(self._pitch_up_masks, self.FRONT_ENA, speed)
 
     def pitch_down(self, speed: int):
         """Pitch down - front motor up, back motor down"""
-        self._set_motor(self.FRONT_IN1, self.FRONT_IN2, self.front_pwm, True, speed)
-        self._set_motor(self.BACK_IN3, self.BACK_IN4, self.back_pwm, False, speed)
-
-    def _set_motor(self, in1_pin: int, in2_pin: int, pwm_obj, forward: bool, speed: int):
-        """Helper method to set individual motor direction and speed"""
-        if forward:
-            GPIO.output(in1_pin, GPIO.HIGH)
-            GPIO.output(in2_pin, GPIO.LOW)
-        else:
-            GPIO.output(in1_pin, GPIO.LOW)
-            GPIO.output(in2_pin, GPIO.HIGH)
-        pwm_obj.ChangeDutyCycle(speed)
+        self._drive(self._pitch_down_masks, self.FRONT_ENA, speed)
+
+    def _drive(self, masks, pwm_pin: int, speed: int):
+        """
+        Helper method to set the direction of a motor pair and drive both at the given speed.
+        Both enable pins of the pair share one hardware PWM channel, so one update sets both.
+        """
+        high_mask, low_mask = masks
+        duty = int(speed) * 10000 # pigpio hardware PWM duty is in millionths
+        with self._lock:
+            # Clear before set so no H-bridge input pair is ever driven high on both sides
+            self.pi.clear_bank_1(low_mask)
+            self.pi.set_bank_1(high_mask)
+            self.pi.hardware_PWM(pwm_pin, PWM_FREQUENCY, duty)
 
     def stop(self):
         """Stop all motors"""
-        self.left_pwm.ChangeDutyCycle(0)
-        self.right_pwm.ChangeDutyCycle(0)
-        self.front_pwm.ChangeDutyCycle(0)
-        self.back_pwm.ChangeDutyCycle(0)
-        
-        # Set all direction pins to LOW
-        GPIO.output(self.LEFT_IN1, GPIO.LOW)
-        GPIO.output(self.LEFT_IN2, GPIO.LOW)
-        GPIO.output(self.RIGHT_IN3, GPIO.LOW)
-        GPIO.output(self.RIGHT_IN4, GPIO.LOW)
-        GPIO.output(self.FRONT_IN1, GPIO.LOW)
-        GPIO.output(self.FRONT_IN2, GPIO.LOW)
-        GPIO.output(self.BACK_IN3, GPIO.LOW)
-        GPIO.output(self.BACK_IN4, GPIO.LOW)
+        with self._lock:
+            # One pin per hardware PWM channel covers all four enables
+            self.pi.hardware_PWM(self.LEFT_ENA, PWM_FREQUENCY, 0)
+            self.pi.hardware_PWM(self.FRONT_ENA, PWM_FREQUENCY, 0)
+
+            # Set all direction pins to LOW
+            self.pi.clear_bank_1(self._all_dir_mask)
 
     def cleanup(self):
         """Cleanup GPIO"""
         self.stop()
-        GPIO.cleanup()
+        MotorControl._instances -= 1
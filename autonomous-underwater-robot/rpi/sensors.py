@@ -1,80 +1,199 @@
 """
 Sensor module for MPU6050 gyroscope and ultrasonic sensors.
 Provides orientation data and distance measurements.
+Ultrasonic sensors use the pigpio daemon (pigpiod must be running).
 """
 
-import smbus
+import smbus2
+import struct
+import statistics
+from array import array
+import threading
 import time
-import RPi.GPIO as GPIO
+import pigpio
 import math
+from gpio_daemon import get_pi
+
+RAD_TO_DEG = 180.0 / math.pi
+GYRO_LSB_PER_DPS = 131.0 # MPU6050 gyro sensitivity at the default +/-250 deg/s full scale
+ECHO_TIMEOUT = 0.04 # seconds; longer than the ~38 ms echo pulse an HC-SR04-style sensor gives at max range
+SPEED_OF_SOUND_AIR = 34300.0 # cm/s at 20 C; sound travels ~4.3x faster in water (~148000 cm/s)
+AGREE_TOLERANCE = 2.0 # cm; two pings this close are taken as a good reading
+
+# Indexes into the orientation buffer returned by MPU6050.get_orientation()
+PITCH, ROLL, YAW = 0, 1, 2
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+def get_bus(number=1):
+    """Returns the process-wide SMBus for /dev/i2c-<number>, opening it on first use"""
+    with _buses_lock:
+        bus = _buses.get(number)
+        if bus is None:
+            bus = _buses[number] = smbus2.SMBus(number)
+        return bus
+
+def _agreement(readings):
+    """Mean of the first two readings (in order) within AGREE_TOLERANCE of each other, else None"""
+    for i, a in enumerate(readings):
+        for b in readings[i + 1:]:
+            if abs(a - b) <= AGREE_TOLERANCE:
+                return (a + b) / 2
+    return None
+
+def combine_readings(readings):
+    """
+    Combines several readings of one sonar into one distance in cm, rejecting spurious echoes
+    (bubbles, hull reflections, cross-talk). Missing echoes (None) are ignored. Returns the mean
+    of the first two readings that agree within AGREE_TOLERANCE, otherwise the low median of the
+    valid readings (the nearer of two that disagree, so the result is never a distance no ping
+    measured and errs towards stopping), or None if there are none.
+    """
+    valid = [r for r in readings if r is not None]
+    if not valid:
+        return None
+    agreed = _agreement(valid)
+    return agreed if agreed is not None else statistics.median_low(valid)
 
 class MPU6050:
     def __init__(self, bus=1, address=0x68):
-        self.bus = smbus.SMBus(bus)
+        # bus is an I2C bus number or an already open SMBus; devices on the same bus number
+        # share one handle (and one /dev/i2c-N file descriptor) through get_bus()
+        self.bus = get_bus(bus) if isinstance(bus, int) else bus
         self.address = address
-        # Wake up MPU6050
+        # Register-pointer write for the data burst, built once and reused for every sample
+        self._data_ptr = smbus2.i2c_msg.write(self.address, [0x3B])
+        # Complementary filter: weight of the integrated gyro angle vs. the accelerometer angle
+        self.alpha = 0.98
+        self.max_filter_dt = 1.0 # seconds; longer gaps restart the filter from the accelerometer
+        # Filter state doubles as the result: get_orientation() updates it in place
+        self.orientation = array('d', (0.0, 0.0, 0.0))
+        self._t_prev = None
+        # Wake up MPU6050. The SLEEP bit reads back clear as soon as it is written, so it says
+        # nothing about readiness; wait out the gyro start-up time instead (30 ms typical per
+        # the datasheet, with some margin)
         self.bus.write_byte_data(self.address, 0x6B, 0)
-        time.sleep(0.1)
+        time.sleep(0.05)
+        # Digital low-pass filter at 44 Hz (CONFIG) and a 100 Hz sample rate (1 kHz / (1 + 9))
+        # so the chip smooths vibration before it reaches get_orientation
+        self.bus.write_byte_data(self.address, 0x1A, 0x03)
+        self.bus.write_byte_data(self.address, 0x19, 9)
 
     def read_word(self, reg):
         high = self.bus.read_byte_data(self.address, reg)
         low = self.bus.read_byte_data(self.address, reg+1)
-        val = (high << 8) + low
-        if val >= 0x8000:
-            return -((65535 - val) + 1)
-        else:
-            return val
+        # Sign-extend the 16-bit two's complement value without branching on the high bit
+        return (((high << 8) | low) ^ 0x8000) - 0x8000
 
     def get_orientation(self):
         """
-        Returns orientation data (pitch, roll, yaw) in degrees
+        Returns orientation data in degrees as an array indexed by PITCH, ROLL and YAW.
+        The same buffer is updated in place on every call; copy it to keep a reading.
         """
-        accel_x = self.read_word(0x3B)
-        accel_y = self.read_word(0x3D)
-        accel_z = self.read_word(0x3F)
+        # One 14-byte burst read from ACCEL_XOUT_H covers accel X/Y/Z, temperature and
+        # gyro X/Y/Z (big-endian signed 16-bit each). The pointer write and the read go out
+        # as one combined (repeated-start) transaction in a single I2C_RDWR ioctl.
+        raw = smbus2.i2c_msg.read(self.address, 14)
+        self.bus.i2c_rdwr(self._data_ptr, raw)
+        accel_x, accel_y, accel_z, _temp, gyro_x, gyro_y, gyro_z = struct.unpack('>hhhhhhh', bytes(raw))
 
-        gyro_x = self.read_word(0x43)
-        gyro_y = self.read_word(0x45)
-        gyro_z = self.read_word(0x47)
+        now = time.perf_counter()
 
         # Calculate pitch and roll from accelerometer data
-        pitch = math.degrees(math.atan2(accel_y, math.sqrt(accel_x**2 + accel_z**2)))
-        roll = math.degrees(math.atan2(-accel_x, accel_z))
-        yaw = 0  # Yaw calculation requires magnetometer or integration of gyro data
+        pitch_acc = math.atan2(accel_y, math.hypot(accel_x, accel_z)) * RAD_TO_DEG
+        roll_acc = math.atan2(-accel_x, accel_z) * RAD_TO_DEG
+
+        orientation = self.orientation
+        if self._t_prev is None or now - self._t_prev > self.max_filter_dt:
+            # First sample (or a long gap): start from the accelerometer angles
+            orientation[PITCH] = pitch_acc
+            orientation[ROLL] = roll_acc
+        else:
+            # Complementary filter: the gyro tracks fast motion, the accelerometer corrects drift
+            dt = now - self._t_prev
+            alpha = self.alpha
+            orientation[PITCH] = alpha * (orientation[PITCH] + gyro_x / GYRO_LSB_PER_DPS * dt) + (1 - alpha) * pitch_acc
+            orientation[ROLL] = alpha * (orientation[ROLL] + gyro_y / GYRO_LSB_PER_DPS * dt) + (1 - alpha) * roll_acc
+            # Yaw has no absolute reference without a magnetometer, so it is gyro-only and drifts
+            orientation[YAW] += gyro_z / GYRO_LSB_PER_DPS * dt
+        self._t_prev = now
 
-        return {'pitch': pitch, 'roll': roll, 'yaw': yaw}
+        return orientation
 
 class UltrasonicSensor:
-    def __init__(self, trigger_pin, echo_pin):
+    def __init__(self, trigger_pin, echo_pin, speed_of_sound=SPEED_OF_SOUND_AIR):
         self.trigger_pin = trigger_pin
         self.echo_pin = echo_pin
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.trigger_pin, GPIO.OUT)
-        GPIO.setup(self.echo_pin, GPIO.IN)
+        # cm per microsecond of echo pulse: speed of sound (cm/s) / 1e6, halved for the round trip
+        self.scale = speed_of_sound / 2e6
+        self.pi = get_pi()
+        self.pi.set_mode(self.trigger_pin, pigpio.OUTPUT)
+        self.pi.write(self.trigger_pin, 0)
+        self.pi.set_mode(self.echo_pin, pigpio.INPUT)
 
-    def get_distance(self):
-        """
-        Returns distance measurement in cm
-        """
-        # Send 10us pulse to trigger
-        GPIO.output(self.trigger_pin, True)
-        time.sleep(0.00001)
-        GPIO.output(self.trigger_pin, False)
+        self._rise_tick = None
+        self._distance = None
+        self._echo_done = threading.Event()
+        # pigpiod timestamps echo edges with microsecond ticks, so Python never polls the echo pin
+        self._callback = self.pi.callback(self.echo_pin, pigpio.EITHER_EDGE, self._on_echo_edge)
+
+    def _on_echo_edge(self, gpio, level, tick):
+        if level == 1:
+            self._rise_tick = tick
+        elif level == 0 and self._rise_tick is not None:
+            self._distance = pigpio.tickDiff(self._rise_tick, tick) * self.scale
+            self._rise_tick = None
+            self._echo_done.set()
+
+    def trigger(self):
+        """Sends a ping; collect the result with wait_for_echo()"""
+        self._rise_tick = None
+        self._distance = None
+        self._echo_done.clear()
 
-        start_time = time.time()
-        stop_time = time.time()
+        # pigpiod emits the 10us trigger pulse itself, so its width doesn't depend on Python scheduling
+        self.pi.gpio_trigger(self.trigger_pin, 10, 1)
 
-        # Save start time
-        while GPIO.input(self.echo_pin) == 0:
-            start_time = time.time()
+    def wait_for_echo(self, timeout=ECHO_TIMEOUT):
+        """
+        Returns the distance in cm for the last trigger(), or None if no echo arrived within timeout
+        """
+        # Block until the echo callback has timed the falling edge, instead of sleeping for the
+        # worst case; a missing echo (nothing in range or a lost ping) times out and returns None
+        if not self._echo_done.wait(timeout):
+            return None
+        return self._distance
 
-        # Save arrival time
-        while GPIO.input(self.echo_pin) == 1:
-            stop_time = time.time()
+    def get_distance(self, shots=3):
+        """
+        Returns distance measurement in cm, or None if no echo was received.
+        Pings up to shots times to reject spurious echoes (bubbles, hull reflections): returns as
+        soon as two readings agree within AGREE_TOLERANCE, otherwise combines them like combine_readings().
+        """
+        readings = []
+        for _ in range(shots):
+            self.trigger()
+            distance = self.wait_for_echo()
+            if distance is None:
+                continue
+            readings.append(distance)
+            agreed = _agreement(readings)
+            if agreed is not None:
+                return agreed
+        return combine_readings(readings)
 
-        # Time difference
-        time_elapsed = stop_time - start_time
-        # Calculate distance (speed of sound 34300 cm/s)
-        distance = (time_elapsed * 34300) / 2
+    def cleanup(self):
+        """Cancel the echo callback (the shared pigpio connection stays open for other devices)"""
+        self._callback.cancel()
 
-        return distance
+def read_all(sensors, timeout=ECHO_TIMEOUT):
+    """
+    Measures several ultrasonic sensors at once. All pings go out together and their echo
+    waits overlap, so the whole read takes one echo time instead of one per sensor.
+    Returns distances in cm (None where no echo arrived), in the order of sensors.
+    """
+    for sensor in sensors:
+        sensor.trigger()
+    deadline = time.monotonic() + timeout
+    return [sensor.wait_for_echo(max(0.0, deadline - time.monotonic())) for sensor in sensors]
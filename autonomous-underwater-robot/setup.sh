@@ -31,8 +31,8 @@ echo ""
 echo "--- 1. Updating system and installing essential packages ---"
 sudo apt update && sudo apt upgrade -y
 
-echo "Installing git, nodejs, npm, python3-venv, python3-pip, python3-smbus..."
-sudo apt install git nodejs npm python3-venv python3-pip python3-smbus -y
+echo "Installing git, nodejs, npm, python3-venv, python3-pip, python3-smbus, pigpio..."
+sudo apt install git nodejs npm python3-venv python3-pip python3-smbus pigpio -y
 
 # Install Yarn globally
 echo "Installing Yarn globally..."
@@ -117,6 +117,11 @@ if grep -q "Raspberry Pi" /proc/cpuinfo; then
         echo "spi-dev" | sudo tee -a /etc/modules
     fi
     
+    # Enable the pigpio daemon used for motor and sensor GPIO access
+    echo "Enabling pigpiod service..."
+    sudo systemctl enable pigpiod
+    sudo systemctl start pigpiod || echo "Warning: pigpiod failed to start. May require reboot."
+
     # Add user to required groups
     echo "Adding user '$CURRENT_USER' to gpio, i2c, spi groups..."
     sudo usermod -a -G gpio,i2c,spi "$CURRENT_USER"
@@ -134,17 +139,26 @@ echo ""
 echo "--- 6. Creating systemd service for Flask API auto-start ---"
 if grep -q "Raspberry Pi" /proc/cpuinfo; then
     SERVICE_FILE="/etc/systemd/system/underwater-robot.service"
+    # Run as IMAGE_ACCEL_REDIRECT_PREFIX=/protected/ ./setup.sh when serving images through
+    # nginx/underwater-robot.conf; otherwise the line is written commented out
+    if [ -n "$IMAGE_ACCEL_REDIRECT_PREFIX" ]; then
+        ACCEL_REDIRECT_ENV="Environment=IMAGE_ACCEL_REDIRECT_PREFIX=$IMAGE_ACCEL_REDIRECT_PREFIX"
+    else
+        ACCEL_REDIRECT_ENV="#Environment=IMAGE_ACCEL_REDIRECT_PREFIX=/protected/"
+    fi
     echo "Creating systemd service file: $SERVICE_FILE"
     sudo tee "$SERVICE_FILE" > /dev/null << EOL
 [Unit]
 Description=Autonomous Underwater Robot Service
-After=network.target
+After=network.target pigpiod.service
+Requires=pigpiod.service
 
 [Service]
-ExecStart=$(pwd)/venv/bin/python $(pwd)/rpi/app.py
+ExecStart=$(pwd)/venv/bin/gunicorn -k gthread -w 1 --threads 8 -b 0.0.0.0:5000 --chdir $(pwd)/rpi app:app
 WorkingDirectory=$(pwd)
 User=$CURRENT_USER
 Environment=PYTHONPATH=$(pwd)
+$ACCEL_REDIRECT_ENV
 Restart=always
 
 [Install]
@@ -0,0 +1,39 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip('flask')
+import app
+
+
+class ReadOnlyBody:
+    """Upload stream with read() but no readinto(), like gunicorn's Body"""
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'UPLOAD_FOLDER', str(tmp_path))
+    return app.app.test_client()
+
+
+def test_save_upload_stream_without_readinto():
+    data = os.urandom(3 * app.UPLOAD_CHUNK_SIZE + 17)
+    out = io.BytesIO()
+    assert app.save_upload_stream(ReadOnlyBody(data), out) == len(data)
+    assert out.getvalue() == data
+
+
+def test_raw_upload_through_stream_without_readinto(client, tmp_path):
+    data = b'\xff\xd8' + os.urandom(100_000) + b'\xff\xd9'
+    response = client.post('/upload_image', content_type='image/jpeg', headers={'Content-Length': str(len(data))},
+                           environ_overrides={'wsgi.input': ReadOnlyBody(data), 'wsgi.input_terminated': True})
+    assert response.status_code == 200
+    assert response.json['size'] == len(data)
+    assert (tmp_path / response.json['filename']).read_bytes() == data
+    assert not list(tmp_path.glob('*.part'))
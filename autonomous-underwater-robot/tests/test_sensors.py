@@ -0,0 +1,23 @@
+import pytest
+
+pytest.importorskip('smbus2')
+pytest.importorskip('pigpio')
+from sensors import combine_readings
+
+
+def test_combine_readings_no_echo():
+    assert combine_readings([None, None, None]) is None
+
+
+def test_combine_readings_agreeing_pair():
+    # A single ghost echo is outvoted by two readings that agree
+    assert combine_readings([5.0, 80.0, 81.0]) == 80.5
+
+
+def test_combine_readings_two_disagreeing_takes_nearer():
+    # Must not invent the 52.5 cm mean; the nearer reading keeps the stop decision conservative
+    assert combine_readings([None, 100.0, 5.0]) == 5.0
+
+
+def test_combine_readings_three_disagreeing_takes_median():
+    assert combine_readings([3.0, 40.0, 90.0]) == 40.0
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { Play, StopCircle, Image } from 'lucide-react';
+import { Play, StopCircle, Image, Video } from 'lucide-react';
 
 // Main App Component
 const App = () => {
@@ -135,6 +135,18 @@ const App = () => {
         </div>
       </section>
 
+      <section className="mb-8 p-4 bg-gray-800 rounded-lg shadow-md">
+        <h2 className="text-xl sm:text-2xl font-semibold text-white mb-4 flex items-center">
+          <Video className="mr-2 h-6 w-6 text-blue-400" /> Live Feed
+        </h2>
+        {/* MJPEG stream: the browser swaps in each new frame as soon as it is uploaded */}
+        <img
+          src={`${API_BASE_URL}/stream`}
+          alt="Live feed from ESP32-CAM"
+          className="w-full max-w-2xl mx-auto rounded-lg shadow-md"
+        />
+      </section>
+
       <section className="p-4 bg-gray-800 rounded-lg shadow-md">
         <h2 className="text-xl sm:text-2xl font-semibold text-white mb-4 flex items-center">
           <Image className="mr-2 h-6 w-6 text-purple-400" /> Latest Images